@@ -19,404 +19,449 @@
 # License along with this library; if not, see <https://www.gnu.org/licenses/>.
 #
 
+import collections
+import contextlib
+import copy
+import dataclasses
+import enum
+import types
 from unittest import mock
 from pathlib import PosixPath
+from typing import Mapping, Optional, Tuple
 
-import asynctest
 import pytest
 
+from .. import utils
 from ..exc import AccessDenied, ExecutionFailed
+from ..policy import parser
 from ..tools import qrexec_policy_exec
 
 # Disable warnings that conflict with Pytest's use of fixtures.
 # pylint: disable=redefined-outer-name
 
 
+# Positional arguments of qrexec-policy-exec used by most of the tests.
+BASE_ARGS = ('source-id', 'source', 'test-vm1', 'service+arg', 'process_ident')
+
+# Expected execute() call for an allowed request, as (args, kwargs).
+_EXECUTE_CALL = (('process_ident,source,source-id',), {})
+
+
+# Mock template is built once and deep-copied for each test, so that
+# recorded calls are not shared between tests.
+_COROUTINE_TEMPLATE = mock.AsyncMock()
+
+
+class Resolution(enum.IntEnum):
+    ASK = 0
+    ALLOW = 1
+    DENY = 2
+
+
+def _make_rule(notify):
+    return types.SimpleNamespace(
+        filepath='file', lineno=42,
+        action=types.SimpleNamespace(notify=notify))
+
+
+@dataclasses.dataclass(frozen=True)
 class TestPolicy:
-    def __init__(self):
-        self.resolution_type = None
-        self.targets_for_ask = None
-        self.default_target = None
-        self.target = None
-        self.rule = mock.NonCallableMock()
-        self.rule.filepath = 'file'
-        self.rulelineno = 42
+    """
+    Policy returning a fixed resolution. The set_*() methods return
+    a modified copy instead of changing the object in place.
+    """
+
+    resolution_type: Optional[Resolution] = None
+    targets_for_ask: Optional[Tuple[str, ...]] = None
+    default_target: Optional[str] = None
+    target: Optional[str] = None
+    rule: types.SimpleNamespace = dataclasses.field(
+        default_factory=lambda: _make_rule(False), hash=False)
 
     def set_ask(self, targets_for_ask, default_target=None, notify=False):
-        self.resolution_type = 'ask'
-        self.targets_for_ask = targets_for_ask
-        self.default_target = default_target
-        self.rule.action.notify = notify
+        return dataclasses.replace(
+            self, resolution_type=Resolution.ASK,
+            targets_for_ask=tuple(targets_for_ask),
+            default_target=default_target,
+            rule=_make_rule(notify))
 
     def set_allow(self, target, notify=False):
-        self.resolution_type = 'allow'
-        self.target = target
-        self.rule.action.notify = notify
+        return dataclasses.replace(
+            self, resolution_type=Resolution.ALLOW, target=target,
+            rule=_make_rule(notify))
 
     def set_deny(self, notify=True):
-        self.resolution_type = 'deny'
-        self.rule.action.notify = notify
+        return dataclasses.replace(
+            self, resolution_type=Resolution.DENY, rule=_make_rule(notify))
+
+    def _evaluate_ask(self, request):
+        return request.ask_resolution_type(
+            self.rule, request, user='user',
+            targets_for_ask=list(self.targets_for_ask),
+            default_target=self.default_target)
+
+    def _evaluate_allow(self, request):
+        return request.allow_resolution_type(
+            self.rule, request, user='user', target=self.target)
+
+    def _evaluate_deny(self, request):
+        raise AccessDenied('denied', notify=self.rule.action.notify)
+
+    _DISPATCH = {
+        Resolution.ASK: _evaluate_ask,
+        Resolution.ALLOW: _evaluate_allow,
+        Resolution.DENY: _evaluate_deny,
+    }
 
     def evaluate(self, request):
         assert self.resolution_type is not None
+        return self._DISPATCH[self.resolution_type](self, request)
 
-        if self.resolution_type == 'ask':
-            return request.ask_resolution_type(
-                self.rule, request, user='user',
-                targets_for_ask=self.targets_for_ask,
-                default_target=self.default_target)
-
-        if self.resolution_type == 'allow':
-            return request.allow_resolution_type(
-                self.rule, request, user='user', target=self.target)
 
-        if self.resolution_type == 'deny':
-            raise AccessDenied('denied', notify=self.rule.action.notify)
+# Policy with no resolution set; being immutable, it can be shared by all
+# tests.
+_EMPTY_POLICY = TestPolicy()
 
-        assert False, self.resolution_type
-        return None
+# Policies used by the tests, built once and shared by all of them.
+_ALLOW_POLICY = _EMPTY_POLICY.set_allow('test-vm1')
+_ALLOW_NOTIFY_POLICY = _EMPTY_POLICY.set_allow('test-vm1', notify=True)
+_ASK_POLICY = _EMPTY_POLICY.set_ask(('test-vm1', 'test-vm2'))
+_ASK_NOTIFY_POLICY = _EMPTY_POLICY.set_ask(
+    ('test-vm1', 'test-vm2'), notify=True)
+_ASK_DEFAULT_TARGET_POLICY = _EMPTY_POLICY.set_ask(
+    ('test-vm1', 'test-vm2'), 'test-vm1')
+_DENY_POLICY = _EMPTY_POLICY.set_deny()
+_DENY_NO_NOTIFY_POLICY = _EMPTY_POLICY.set_deny(notify=False)
 
 
-@pytest.fixture(autouse=True)
-def policy():
+@pytest.fixture(scope='session')
+def _system_info_template():
     """
-    Mock for FilePolicy object that will evaluate the requests.
+    System info shared by all tests. It is read-only; tests that modify it
+    have to be marked with ``mutates_system_info``, so that they get their own
+    mutable copy.
     """
 
-    policy = TestPolicy()
-    with mock.patch('qrexec.policy.parser.FilePolicy') as mock_policy:
-        mock_policy.return_value = policy
-        yield policy
+    domains = {
+        'dom0': {'icon': 'black', 'template_for_dispvms': False,
+                 'guivm': None},
+        'source': {'icon': 'red', 'template_for_dispvms': False,
+                   'guivm': 'gui'},
+        'test-vm1': {'icon': 'red', 'template_for_dispvms': False,
+                     'guivm': None},
+        'test-vm2': {'icon': 'red', 'template_for_dispvms': False,
+                     'guivm': None},
+        'test-vm3': {'icon': 'green', 'template_for_dispvms': True,
+                     'guivm': None},
+        'gui': {'icon': 'orange', 'template_for_dispvms': False,
+                'guivm': None},
+    }
+    return types.MappingProxyType({
+        'domains': types.MappingProxyType({
+            name: types.MappingProxyType(domain)
+            for name, domain in domains.items()}),
+    })
 
-    assert mock_policy.mock_calls == [
-        mock.call(policy_path=PosixPath('/etc/qubes/policy.d'))
-    ]
 
+@pytest.fixture(scope='session')
+def icons(_system_info_template):
+    icons = {name: domain['icon']
+             for name, domain in _system_info_template['domains'].items()}
+    icons['@dispvm:test-vm3'] = icons['test-vm3']
+    return icons
 
-@pytest.fixture(autouse=True)
-def system_info():
-    system_info = {
-        'domains': {
-            'dom0': {'icon': 'black', 'template_for_dispvms': False,
-                     'guivm': None},
-            'source': {'icon': 'red', 'template_for_dispvms': False,
-                       'guivm': 'gui'},
-            'test-vm1': {'icon': 'red', 'template_for_dispvms': False,
-                         'guivm': None},
-            'test-vm2': {'icon': 'red', 'template_for_dispvms': False,
-                         'guivm': None},
-            'test-vm3': {'icon': 'green', 'template_for_dispvms': True,
-                         'guivm': None},
-            'gui': {'icon': 'orange', 'template_for_dispvms': False,
-                    'guivm': None},
-        }
-    }
-    with mock.patch('qrexec.utils.get_system_info') as mock_system_info:
-        mock_system_info.return_value = system_info
-        yield system_info
-
-
-def icons():
-    return {
-        'dom0': 'black',
-        'source': 'red',
-        'test-vm1': 'red',
-        'test-vm2': 'red',
-        'test-vm3': 'green',
-        'gui': 'orange',
-        '@dispvm:test-vm3': 'green',
-    }
+
+@pytest.fixture(scope='session')
+def _policy_mock():
+    return mock.Mock()
+
+
+@pytest.fixture(scope='session')
+def _system_info_mock():
+    return mock.Mock()
+
+
+@dataclasses.dataclass(frozen=True)
+class Env:
+    #: mock for FilePolicy; tests set its return_value to a TestPolicy object
+    #: that will evaluate the requests
+    policy: mock.Mock
+    #: system info returned by get_system_info(); read-only unless the test
+    #: is marked with ``mutates_system_info``
+    system_info: Mapping
+    #: mock for execute() for allowed action; it is supposed to call the qrexec
+    execute: mock.AsyncMock
+    #: mock for call_socket_service() used to contact the qrexec-policy-agent
+    agent_service: mock.AsyncMock
 
 
 @pytest.fixture(autouse=True)
-def execute():
+def env(request, _policy_mock, _system_info_mock, _system_info_template):
     """
-    Mock for execute() for allowed action. It is supposed to call the qrexec.
+    Replace FilePolicy, get_system_info(), AllowResolution.execute() and
+    call_socket_service() with mocks for the duration of a test.
+
+    The FilePolicy and get_system_info() mocks are shared by the whole
+    session and reset before each test.
+    """
+
+    _policy_mock.reset_mock(return_value=True, side_effect=True)
+    _policy_mock.return_value = _EMPTY_POLICY
+
+    if request.node.get_closest_marker('mutates_system_info'):
+        system_info = {'domains': {
+            name: dict(domain)
+            for name, domain in _system_info_template['domains'].items()}}
+    else:
+        system_info = _system_info_template
+    _system_info_mock.reset_mock(return_value=True, side_effect=True)
+    _system_info_mock.return_value = system_info
+
+    env = Env(
+        policy=_policy_mock,
+        system_info=system_info,
+        execute=copy.deepcopy(_COROUTINE_TEMPLATE),
+        agent_service=copy.deepcopy(_COROUTINE_TEMPLATE))
+
+    with contextlib.ExitStack() as stack:
+        for obj, name, value in [
+                (parser, 'FilePolicy', env.policy),
+                (utils, 'get_system_info', _system_info_mock),
+                (parser.AllowResolution, 'execute', env.execute),
+                (qrexec_policy_exec, 'call_socket_service', env.agent_service),
+        ]:
+            stack.callback(setattr, obj, name, getattr(obj, name))
+            setattr(obj, name, value)
+        yield env
+
+    assert_calls(
+        env.policy, ((), {'policy_path': PosixPath('/etc/qubes/policy.d')}))
+
+
+@pytest.fixture
+def policy(env):
+    """
+    Mock for FilePolicy (not a TestPolicy). Tests set its return_value to
+    the TestPolicy that should evaluate the request.
     """
 
-    with mock.patch('qrexec.policy.parser.AllowResolution.execute',
-                    asynctest.CoroutineMock()) as mock_execute:
-        yield mock_execute
+    return env.policy
 
 
-@pytest.fixture(autouse=True)
-def agent_service():
+@pytest.fixture
+def system_info(env):
+    return env.system_info
+
+
+@pytest.fixture
+def execute(env):
+    return env.execute
+
+
+@pytest.fixture
+def agent_service(env):
+    return env.agent_service
+
+
+def assert_calls(mock_obj, *expected):
     """
-    Mock for call_socket_service() used to contact the qrexec-policy-agent.
+    Compare calls recorded by a mock with (args, kwargs) tuples. Only calls
+    of the mock itself are expected; a call of one of its children (or of
+    a method on it) makes the assertion fail.
     """
 
-    with mock.patch('qrexec.tools.qrexec_policy_exec.call_socket_service',
-                    asynctest.CoroutineMock()) as mock_call_socket_service:
-        yield mock_call_socket_service
+    calls = [(c[0], c.args, c.kwargs) for c in mock_obj.mock_calls]
+    assert calls == [('', args, kwargs) for args, kwargs in expected]
 
 
 def notify_call(resolution, *, argument='+arg'):
     """
-    Mock call() object for policy.Notify.
+    Expected call_socket_service() call for policy.Notify.
     """
 
-    return mock.call('gui', 'policy.Notify', 'dom0', {
+    return (('gui', 'policy.Notify', 'dom0', types.MappingProxyType({
         'resolution': resolution,
         'service': 'service',
         'source': 'source',
         'argument': argument,
         'target': 'test-vm1',
-    })
+    })), {})
 
 
-def ask_call(*, argument='+arg', default_target=''):
+# Expected policy.Notify calls, built once and shared (read-only) by all
+# tests.
+_NOTIFY_ALLOW = notify_call('allow')
+_NOTIFY_ALLOW_NO_ARGUMENT = notify_call('allow', argument='+')
+_NOTIFY_FAIL = notify_call('fail')
+_NOTIFY_DENY = notify_call('deny')
+
+
+def ask_call(icons, *, argument='+arg', default_target=''):
     """
-    Mock call() object for policy.Ask.
+    Expected call_socket_service() call for policy.Ask.
     """
 
-    return mock.call('gui', 'policy.Ask', 'dom0', {
+    return (('gui', 'policy.Ask', 'dom0', {
         'source': 'source',
         'service': 'service',
         'argument': argument,
         'targets': ['test-vm1', 'test-vm2'],
         'default_target': default_target,
-        'icons': icons(),
-    })
-
-
-
-def test_000_allow(policy, execute, agent_service):
-    policy.set_allow('test-vm1')
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 0
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
-
-
-def test_001_allow_notify(policy, execute, agent_service):
-    policy.set_allow('test-vm1', notify=True)
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 0
-    assert agent_service.mock_calls == [
-        notify_call('allow'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
+        'icons': icons,
+    }), {})
 
 
 def test_002_allow_notify_failed(policy, execute, agent_service):
-    policy.set_allow('test-vm1', notify=True)
+    policy.return_value = _ALLOW_NOTIFY_POLICY
     agent_service.side_effect = Exception("calling agent service failed")
 
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 0
-    assert agent_service.mock_calls == [
-        notify_call('allow'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
+    assert_calls(agent_service, _NOTIFY_ALLOW)
+    assert_calls(execute, _EXECUTE_CALL)
 
 
 def test_003_allow_execution_failed(policy, execute, agent_service):
-    policy.set_allow('test-vm1', notify=True)
+    policy.return_value = _ALLOW_NOTIFY_POLICY
     execute.side_effect = ExecutionFailed()
 
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == [
-        notify_call('allow'),
-        notify_call('fail'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
+    assert_calls(agent_service, _NOTIFY_ALLOW, _NOTIFY_FAIL)
+    assert_calls(execute, _EXECUTE_CALL)
 
 
+@pytest.mark.mutates_system_info
 def test_004_allow_no_guivm(policy, system_info, execute, agent_service):
     system_info['domains']['source']['guivm'] = None
-    policy.set_allow('test-vm1', notify=True)
+    policy.return_value = _ALLOW_NOTIFY_POLICY
     execute.side_effect = ExecutionFailed()
 
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
+    assert_calls(agent_service)
+    assert_calls(execute, _EXECUTE_CALL)
 
 
-def test_010_ask_allow(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'])
+def test_010_ask_allow(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_POLICY
     agent_service.return_value = 'allow:test-vm1'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 0
-    assert agent_service.mock_calls == [
-        ask_call(),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
-
-def test_011_ask_allow_notify(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'], notify=True)
+    assert_calls(agent_service, ask_call(icons))
+    assert_calls(execute, _EXECUTE_CALL)
+
+def test_011_ask_allow_notify(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_NOTIFY_POLICY
     agent_service.return_value = 'allow:test-vm1'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 0
-    assert agent_service.mock_calls == [
-        ask_call(),
-        notify_call('allow'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
-
-def test_012_ask_allow_notify_no_argument(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'], notify=True)
+    assert_calls(agent_service, ask_call(icons), _NOTIFY_ALLOW)
+    assert_calls(execute, _EXECUTE_CALL)
+
+def test_012_ask_allow_notify_no_argument(policy, agent_service, execute,
+                                          icons):
+    policy.return_value = _ASK_NOTIFY_POLICY
     agent_service.return_value = 'allow:test-vm1'
     retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service', 'process_ident'])
+        [*BASE_ARGS[:3], 'service', *BASE_ARGS[4:]])
     assert retval == 0
-    assert agent_service.mock_calls == [
-        ask_call(argument='+'),
-        notify_call('allow', argument='+'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
-
-def test_015_ask_deny(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'])
+    assert_calls(agent_service,
+                 ask_call(icons, argument='+'), _NOTIFY_ALLOW_NO_ARGUMENT)
+    assert_calls(execute, _EXECUTE_CALL)
+
+def test_015_ask_deny(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_POLICY
     agent_service.return_value = 'deny'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == [
-        ask_call(),
-    ]
-    assert execute.mock_calls == []
+    assert_calls(agent_service, ask_call(icons))
+    assert_calls(execute)
 
 
-def test_016_ask_deny_notify(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'], notify=True)
+def test_016_ask_deny_notify(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_NOTIFY_POLICY
     agent_service.return_value = 'deny'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == [
-        ask_call(),
-        notify_call('deny'),
-    ]
-    assert execute.mock_calls == []
+    assert_calls(agent_service, ask_call(icons), _NOTIFY_DENY)
+    assert_calls(execute)
 
 
-def test_017_ask_default_target(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'], 'test-vm1')
+def test_017_ask_default_target(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_DEFAULT_TARGET_POLICY
     agent_service.return_value = 'allow:test-vm1'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 0
-    assert agent_service.mock_calls == [
-        ask_call(default_target='test-vm1'),
-    ]
-    assert execute.mock_calls == [
-        mock.call('process_ident,source,source-id'),
-    ]
+    assert_calls(agent_service, ask_call(icons, default_target='test-vm1'))
+    assert_calls(execute, _EXECUTE_CALL)
 
 
-def test_018_ask_invalid_response(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'])
+def test_018_ask_invalid_response(policy, agent_service, execute, icons):
+    policy.return_value = _ASK_POLICY
     agent_service.return_value = 'xxx'
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == [
-        ask_call(),
-        notify_call('deny'),
-    ]
-    assert execute.mock_calls == []
+    assert_calls(agent_service, ask_call(icons), _NOTIFY_DENY)
+    assert_calls(execute)
 
 
+@pytest.mark.mutates_system_info
 def test_013_ask_no_guivm(policy, system_info, agent_service, execute):
     system_info['domains']['source']['guivm'] = None
-    policy.set_ask(['test-vm1', 'test-vm2'])
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    policy.return_value = _ASK_POLICY
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
-
-
-def test_020_deny(policy, agent_service, execute):
-    policy.set_deny()
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 1
-    assert agent_service.mock_calls == [
-        notify_call('deny'),
-    ]
-    assert execute.mock_calls == []
-
-
-def test_021_deny_no_notify(policy, agent_service, execute):
-    policy.set_deny(notify=False)
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
+    assert_calls(agent_service)
+    assert_calls(execute)
 
 
+@pytest.mark.mutates_system_info
 def test_022_deny_no_guivm(policy, system_info, agent_service, execute):
     system_info['domains']['source']['guivm'] = None
-    policy.set_deny()
-    retval = qrexec_policy_exec.main(
-        ['source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
-
-
-def test_030_just_evaluate_allow(policy, agent_service, execute):
-    policy.set_allow('test-vm1')
-    retval = qrexec_policy_exec.main(
-        ['--just-evaluate',
-         'source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 0
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
-
-
-def test_031_just_evaluate_deny(policy, agent_service, execute):
-    policy.set_deny()
-    retval = qrexec_policy_exec.main(
-        ['--just-evaluate',
-         'source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
+    policy.return_value = _DENY_POLICY
+    retval = qrexec_policy_exec.main(list(BASE_ARGS))
     assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
-
-
-def test_032_just_evaluate_ask(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'])
-    retval = qrexec_policy_exec.main(
-        ['--just-evaluate',
-         'source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 1
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
-
-
-def test_033_just_evaluate_ask_assume_yes(policy, agent_service, execute):
-    policy.set_ask(['test-vm1', 'test-vm2'])
-    retval = qrexec_policy_exec.main(
-        ['--just-evaluate', '--assume-yes-for-ask',
-         'source-id', 'source', 'test-vm1', 'service+arg', 'process_ident'])
-    assert retval == 0
-    assert agent_service.mock_calls == []
-    assert execute.mock_calls == []
+    assert_calls(agent_service)
+    assert_calls(execute)
+
+
+# Arguments and expected outcome of a single qrexec-policy-exec call.
+PolicyExecCase = collections.namedtuple('PolicyExecCase', [
+    'policy', 'args', 'retval', 'agent_calls', 'execute_calls'])
+
+
+@pytest.mark.parametrize('case', [
+    pytest.param(
+        PolicyExecCase(_ALLOW_POLICY, [], 0, [], [_EXECUTE_CALL]),
+        id='000_allow'),
+    pytest.param(
+        PolicyExecCase(_ALLOW_NOTIFY_POLICY, [], 0, [_NOTIFY_ALLOW],
+                       [_EXECUTE_CALL]),
+        id='001_allow_notify'),
+    pytest.param(
+        PolicyExecCase(_DENY_POLICY, [], 1, [_NOTIFY_DENY], []),
+        id='020_deny'),
+    pytest.param(
+        PolicyExecCase(_DENY_NO_NOTIFY_POLICY, [], 1, [], []),
+        id='021_deny_no_notify'),
+    pytest.param(
+        PolicyExecCase(_ALLOW_POLICY, ['--just-evaluate'], 0, [], []),
+        id='030_just_evaluate_allow'),
+    pytest.param(
+        PolicyExecCase(_DENY_POLICY, ['--just-evaluate'], 1, [], []),
+        id='031_just_evaluate_deny'),
+    pytest.param(
+        PolicyExecCase(_ASK_POLICY, ['--just-evaluate'], 1, [], []),
+        id='032_just_evaluate_ask'),
+    pytest.param(
+        PolicyExecCase(_ASK_POLICY,
+                       ['--just-evaluate', '--assume-yes-for-ask'], 0, [], []),
+        id='033_just_evaluate_ask_assume_yes'),
+])
+def test_policy_exec(env, case):
+    env.policy.return_value = case.policy
+    retval = qrexec_policy_exec.main([*case.args, *BASE_ARGS])
+    assert retval == case.retval
+    assert_calls(env.agent_service, *case.agent_calls)
+    assert_calls(env.execute, *case.execute_calls)
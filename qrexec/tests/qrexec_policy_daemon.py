@@ -22,7 +22,6 @@ import asyncio
 from contextlib import suppress
 
 import pytest
-import asynctest
 from unittest.mock import Mock
 import functools
 
@@ -35,7 +34,7 @@ from ..tools import qrexec_policy_daemon
 class TestPolicyDaemon:
     @pytest.fixture
     def mock_request(self, monkeypatch):
-        mock_request = asynctest.CoroutineMock()
+        mock_request = unittest.mock.AsyncMock()
         monkeypatch.setattr('qrexec.tools.qrexec_policy_daemon.handle_request',
                             mock_request)
         return mock_request